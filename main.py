@@ -1,13 +1,27 @@
+import os
+
+# Whisper (CTranslate2) and Coqui (PyTorch) share this process and its CUDA context.
+# Both read their allocator settings at import/first CUDA use, so set them first.
+# Reuse freed GPU blocks across requests instead of cudaMalloc/cudaFree per call
+os.environ.setdefault("CT2_CUDA_ALLOCATOR", "cub_caching")
+os.environ.setdefault("CT2_USE_EXPERIMENTAL_PACKED_GEMM", "1")
+# Let PyTorch grow segments in place so it fragments less next to CTranslate2's pool
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
-import subprocess
-import tempfile
-from pathlib import Path
-from faster_whisper import WhisperModel
-import os
+import asyncio
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from faster_whisper import WhisperModel, decode_audio
+from TTS.api import TTS
+import numpy as np
+import torch
 
 app = FastAPI()
 
@@ -21,61 +35,179 @@ app.add_middleware(
 
 
 model: Optional[WhisperModel] = None
+tts_model: Optional[TTS] = None
+
+TTS_MODEL = os.getenv("TTS_MODEL", "tts_models/en/ljspeech/tacotron2-DDC")
+TTS_DEVICE = os.getenv("TTS_DEVICE", "auto").lower()
+# "mp3" (default, widest client support) or "opus" (WebM/Opus, ~5x smaller for voice)
+TTS_FORMAT = os.getenv("TTS_FORMAT", "mp3").lower()
+
+ENCODER_ARGS = {
+    "mp3": ["-f", "mp3", "-b:a", os.getenv("TTS_MP3_BITRATE", "128k")],
+    "opus": [
+        "-c:a", "libopus",
+        "-b:a", os.getenv("TTS_OPUS_BITRATE", "24k"),
+        "-application", "voip",
+        "-frame_duration", "20",
+        "-f", "webm",
+    ],
+}
+MEDIA_TYPES = {"mp3": "audio/mpeg", "opus": "audio/webm"}
+if TTS_FORMAT not in ENCODER_ARGS:
+    TTS_FORMAT = "mp3"
 
 
 @app.on_event("startup")
 def load_model() -> None:
-    global model
-    model = WhisperModel("small", device="cuda", compute_type="float16")
+    global model, tts_model
+    # Best first: bf16 variants need Ampere+ (CC >= 8.0); plain float16 always works
+    major, _ = torch.cuda.get_device_capability()
+    compute_types = ["int8_bfloat16", "int8_float16", "float16"] if major >= 8 else ["int8_float16", "float16"]
+    override = os.getenv("WHISPER_COMPUTE_TYPE")
+    if override:
+        compute_types = [override] + [c for c in compute_types if c != override]
+    for i, compute_type in enumerate(compute_types):
+        try:
+            model = WhisperModel("small", device="cuda", compute_type=compute_type)
+            break
+        except Exception as exc:
+            if i == len(compute_types) - 1:
+                raise
+            print(f"Whisper compute_type {compute_type} rejected: {exc}")
+    # Keep Coqui resident next to Whisper so /tts only pays for inference and both
+    # models share one CUDA context instead of each process paying for its own
+    tts_gpu = TTS_DEVICE != "cpu" and torch.cuda.is_available()
+    tts_model = TTS(model_name=TTS_MODEL, gpu=tts_gpu)
+
+    # Pay cuBLAS/cuDNN init and kernel selection here rather than on the first request
+    try:
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), language="en", beam_size=1)
+        list(segments)
+        tts_model.tts("hello")
+    except Exception as exc:
+        print(f"Warmup failed: {exc}")
 
 
 class TTSRequest(BaseModel):
     text: str
 
 
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+# Coqui isn't safe to call concurrently and every call lands on the same GPU:
+# give it one dedicated thread so it neither races itself nor ties up the
+# shared threadpool that /listen and file I/O use
+_SYNTH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-synth")
+
+
+async def run_synthesis(text: str) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(_SYNTH_POOL, synthesize_pcm, text)
+
+
+def synthesize_pcm(text: str) -> bytes:
+    wav = np.asarray(tts_model.tts(text), dtype=np.float32)
+    if not wav.flags.owndata or not wav.flags.writeable:
+        wav = wav.copy()  # never clip a buffer the model may still hold
+    # Clip in place, then scale straight into the int16 output: two passes, no float temp
+    np.clip(wav, -1.0, 1.0, out=wav)
+    pcm = np.empty(wav.shape, dtype=np.int16)
+    np.multiply(wav, np.float32(32767.0), out=pcm, casting="unsafe")
+    return pcm.tobytes()
+
+
 @app.post("/tts")
-def tts_endpoint(req: TTSRequest):
+async def tts_endpoint(req: TTSRequest):
     if not req.text:
         raise HTTPException(status_code=400, detail="Missing text")
 
-    script_path = Path(__file__).resolve().parent / "python" / "tts.py"
-    process = subprocess.Popen(
-        ["python3", str(script_path), "--stream"],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        bufsize=0,
-    )
+    if tts_model is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+
+    sentences = [s for s in SENTENCE_SPLIT.split(req.text.strip()) if s.strip()] or [req.text]
 
+    # Synthesize the first sentence up front so failures still surface as a 500
     try:
-        process.stdin.write(req.text.encode())
-        process.stdin.close()
-    except Exception:
-        process.kill()
-        raise HTTPException(status_code=500, detail="Failed to write to TTS process")
+        first_pcm = await run_synthesis(sentences[0])
+    except Exception as exc:
+        print(f"TTS synthesis failed: {exc}")
+        raise HTTPException(status_code=500, detail="TTS synthesis failed")
+
+    sr = getattr(tts_model, "output_sample_rate", None) or getattr(
+        tts_model.synthesizer, "output_sample_rate", 22050
+    )
+
+    # ffmpeg only encodes PCM -> MP3/Opus here; synthesis happens in-process
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-f", "s16le",
+        "-ar", str(int(sr)),
+        "-ac", "1",
+        "-i", "pipe:0",
+        *ENCODER_ARGS[TTS_FORMAT],
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
 
-    def iter_audio():
+    async def feed_pcm():
+        # Remaining sentences are synthesized while earlier frames stream out
+        try:
+            process.stdin.write(first_pcm)
+            await process.stdin.drain()
+            for sentence in sentences[1:]:
+                process.stdin.write(await run_synthesis(sentence))
+                await process.stdin.drain()
+        except Exception as exc:
+            print(f"TTS synthesis failed mid-stream: {exc}")
+        finally:
+            process.stdin.close()
+
+    async def iter_audio():
+        # Feed concurrently so a full stdout pipe can't deadlock the writer
+        feeder = asyncio.create_task(feed_pcm())
         try:
             while True:
-                chunk = process.stdout.read(1024)
+                chunk = await process.stdout.read(65536)
                 if not chunk:
                     break
                 yield chunk
-            return_code = process.wait()
+            return_code = await process.wait()
             if return_code != 0:
-                err = process.stderr.read().decode()
+                err = (await process.stderr.read()).decode()
                 raise HTTPException(status_code=500, detail=err)
         finally:
-            process.stdout.close()
-            process.stderr.close()
+            if not feeder.done():
+                feeder.cancel()
+            if process.returncode is None:
+                process.kill()
 
+    # Starlette applies chunked transfer encoding itself for streamed bodies
+    media_type = MEDIA_TYPES[TTS_FORMAT]
     headers = {
         "Cache-Control": "no-cache",
-        "Content-Type": "audio/mpeg",
-        "Transfer-Encoding": "chunked",
+        "Content-Type": media_type,
     }
 
-    return StreamingResponse(iter_audio(), media_type="audio/mpeg", headers=headers)
+    return StreamingResponse(iter_audio(), media_type=media_type, headers=headers)
+
+
+def transcribe_bytes(data: bytes) -> str:
+    # Decode straight from memory to 16 kHz mono float32 (PyAV); no temp file
+    audio = decode_audio(io.BytesIO(data), sampling_rate=16000)
+    segments, _ = model.transcribe(
+        audio,
+        language="en",
+        beam_size=1,
+        best_of=1,
+        vad_filter=True,
+        condition_on_previous_text=False,
+        word_timestamps=False,
+    )
+    return "".join([segment.text for segment in list(segments)]).strip()
 
 
 @app.post("/listen")
@@ -86,25 +218,14 @@ async def listen(file: Optional[UploadFile] = File(None)):
     if model is None:
         raise HTTPException(status_code=500, detail="Model not loaded")
 
-    suffix = Path(file.filename).suffix or ".webm"
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            data = await file.read()
-            tmp.write(data)
-            tmp_path = tmp.name
-
+        data = await file.read()
         size = len(data)
-        segments, _ = model.transcribe(tmp_path)
-        text = "".join(segment.text for segment in segments).strip()
+        text = await run_in_threadpool(transcribe_bytes, data)
         print(f"Transcribed {file.filename} ({size} bytes): {text}")
     except Exception as exc:
         print(f"Transcription failed for {file.filename}: {exc}")
         raise HTTPException(status_code=500, detail="Transcription failed")
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
 
     return {"text": text}
 
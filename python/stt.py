@@ -1,12 +1,16 @@
+import io
 import os
 import logging
-import tempfile
-from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+
+# Reuse freed GPU blocks across requests instead of cudaMalloc/cudaFree per call
+os.environ.setdefault("CT2_CUDA_ALLOCATOR", "cub_caching")
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+import numpy as np
 import torch
 import uvicorn
 
@@ -38,28 +42,105 @@ app.add_middleware(
 
 # ---- Whisper model ----
 model: Optional[WhisperModel] = None
+# Batches a clip's VAD segments through the encoder/decoder together
+pipeline: Optional[BatchedInferencePipeline] = None
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))
+SAMPLE_RATE = 16000  # Whisper's native input rate
+
+# Uvicorn worker processes; each loads its own model in the startup hook
+WORKERS = max(1, int(os.getenv("WORKERS", "2")))
+# Concurrent transcriptions per model (separate CUDA streams / CPU replicas)
+WHISPER_NUM_WORKERS = max(1, int(os.getenv("WHISPER_NUM_WORKERS", "2")))
+WHISPER_PARALLELISM = {
+    "num_workers": WHISPER_NUM_WORKERS,
+    # Split cores across every replica in every uvicorn worker, not just the workers
+    "cpu_threads": int(os.getenv(
+        "WHISPER_CPU_THREADS", str(max(1, (os.cpu_count() or 1) // (WORKERS * WHISPER_NUM_WORKERS))),
+    )),
+}
+
+def gpu_compute_types() -> List[str]:
+    """CTranslate2 compute types to try on GPU, best first.
+
+    Ampere+ (CC >= 8.0) gets int8_bfloat16 first; some newer cards reject
+    int8_float16 but accept the bf16 variant. Later entries are fallbacks.
+    """
+    candidates = ["int8_float16", "float16"]
+    try:
+        major, _ = torch.cuda.get_device_capability()
+    except Exception:
+        major = 0
+    if major >= 8:
+        candidates.insert(0, "int8_bfloat16")
+    override = os.getenv("WHISPER_COMPUTE_TYPE")
+    if override:
+        candidates = [override] + [c for c in candidates if c != override]
+    return candidates
 
 @app.on_event("startup")
 def load_model() -> None:
     """Load Whisper, prefer GPU; fall back to CPU."""
-    global model
-    use_gpu = torch.cuda.is_available()
-    device = "cuda" if use_gpu else "cpu"
-    compute_type = "float16" if use_gpu else "int8"
+    global model, pipeline
+    if model is not None:
+        return
+    model_name = os.getenv("WHISPER_MODEL", "distil-small.en")
+
+    if torch.cuda.is_available():
+        for compute_type in gpu_compute_types():
+            logger.info("Loading Whisper model '%s' on cuda (%s)...", model_name, compute_type)
+            try:
+                model = WhisperModel(model_name, device="cuda", compute_type=compute_type, **WHISPER_PARALLELISM)
+                logger.info("✅ Whisper STT running on GPU (%s)", compute_type)
+                break
+            except Exception as exc:
+                logger.warning("Model load failed on cuda (%s): %s", compute_type, exc)
+
+    if model is None:
+        # WHISPER_COMPUTE_TYPE only applies to CPU on CPU-only hosts; after a GPU failure use int8
+        compute_type = "int8" if torch.cuda.is_available() else os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+        logger.warning("⚠️ Whisper STT running on CPU (%s)", compute_type)
+        model = WhisperModel(model_name, device="cpu", compute_type=compute_type, **WHISPER_PARALLELISM)
 
-    model_name = os.getenv("WHISPER_MODEL", "medium.en")
-    logger.info("Loading Whisper model '%s' on %s (%s)...", model_name, device, compute_type)
+    if WHISPER_BATCH_SIZE > 1:
+        pipeline = BatchedInferencePipeline(model=model)
 
+    warmup_model()
+
+def warmup_model() -> None:
+    """Run one silent transcription so kernel selection/lazy init happens before the first request."""
+    if model is None:
+        return
     try:
-        model = WhisperModel(model_name, device=device, compute_type=compute_type)
-        if use_gpu:
-            logger.info("✅ Whisper STT running on GPU")
-        else:
-            logger.warning("⚠️ Whisper STT running on CPU")
+        dummy = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        segments, _ = model.transcribe(dummy, language="en", beam_size=1)
+        list(segments)
+        logger.info("Whisper warmup done")
     except Exception as exc:
-        logger.warning("Model load failed on %s (%s): %s", device, compute_type, exc)
-        logger.warning("Falling back to CPU (int8)")
-        model = WhisperModel(model_name, device="cpu", compute_type="int8")
+        logger.warning("Whisper warmup failed: %s", exc)
+
+def transcribe_bytes(data: bytes, name: Optional[str]) -> str:
+    """Decode + transcribe synchronously; runs in the threadpool, off the event loop."""
+    # Decode straight from memory to 16 kHz mono float32 (PyAV); no temp file
+    audio = decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+
+    logger.info("Transcribing %s (%s bytes, %.2fs)", name, len(data), len(audio) / SAMPLE_RATE)
+    # Greedy decode, fixed language and VAD: conversational clips don't need beam search
+    options = dict(
+        language="en",
+        beam_size=1,
+        best_of=1,
+        vad_filter=True,
+        condition_on_previous_text=False,
+        word_timestamps=False,
+    )
+    if pipeline is not None:
+        segments, info = pipeline.transcribe(audio, batch_size=WHISPER_BATCH_SIZE, **options)
+    else:
+        segments, info = model.transcribe(audio, **options)
+    # segments is lazy; decoding happens here, so keep this in the worker thread
+    segs = list(segments)
+    logger.info("Decoded %d segment(s)", len(segs))
+    return "".join([seg.text for seg in segs]).strip() or ""
 
 @app.post("/listen")
 async def listen(file: UploadFile = File(...)) -> Dict[str, str]:
@@ -68,19 +149,9 @@ async def listen(file: UploadFile = File(...)) -> Dict[str, str]:
     if not file:
         raise HTTPException(status_code=400, detail="No file provided")
 
-    suffix = Path((file.filename or "")).suffix or ".webm"
-    tmp_path = None
-
     try:
         data = await file.read()
-        size = len(data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(data)
-            tmp_path = tmp.name
-
-        logger.info("Transcribing %s (%s bytes) -> %s", file.filename, size, tmp_path)
-        segments, info = model.transcribe(tmp_path)
-        text = "".join(seg.text for seg in segments).strip() or ""
+        text = await run_in_threadpool(transcribe_bytes, data, file.filename)
         logger.info("Transcription done: %r", text)
         return {"text": text}
 
@@ -88,13 +159,6 @@ async def listen(file: UploadFile = File(...)) -> Dict[str, str]:
         logger.exception("Transcription failed for %s: %s", getattr(file, "filename", "<no-name>"), exc)
         raise HTTPException(status_code=500, detail="Transcription failed")
 
-    finally:
-        if tmp_path:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
-
 @app.get("/health")
 def health() -> Dict[str, str]:
     mode = "gpu" if torch.cuda.is_available() else "cpu"
@@ -103,4 +167,5 @@ def health() -> Dict[str, str]:
 if __name__ == "__main__":
     # Default to 8001 to match your PM2/cloudflared routing; override via PORT env if needed.
     port = int(os.getenv("PORT", "8001"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Import string (not the app object) so uvicorn can spawn WORKERS processes
+    uvicorn.run("stt:app", host="0.0.0.0", port=port, workers=WORKERS)
@@ -3,9 +3,13 @@ import sys
 import os
 import argparse
 import json
+import re
 import numpy as np
-import subprocess
-import threading
+
+try:  # Optional: in-process SIMD resampling for TTS_MP3_RATE
+    import soxr
+except Exception:
+    soxr = None
 
 # Avoid broken pipe crashes if client disconnects
 try:
@@ -14,13 +18,28 @@ try:
 except Exception:
     pass
 
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
-def synthesize_text(text: str):
+def _want_gpu() -> bool:
+    """TTS_DEVICE=auto|cuda|cpu; auto uses CUDA when torch can see a GPU."""
+    device = os.environ.get("TTS_DEVICE", "auto").lower()
+    if device == "cpu":
+        return False
+    try:
+        import torch
+        available = torch.cuda.is_available()
+    except Exception:
+        available = False
+    if device == "cuda" and not available:
+        eprint("[tts.py] CUDA requested but unavailable, using CPU")
+    return available
+
+def load_tts():
     """
-    Return (wav_f32_mono, sample_rate).
-    Uses Coqui TTS offline model by default.
+    Load the Coqui TTS offline model once; reused for every sentence.
     """
     model_id = os.environ.get("TTS_MODEL", "tts_models/en/ljspeech/tacotron2-DDC")
     eprint(f"[tts.py] loading model {model_id}")
@@ -31,78 +50,134 @@ def synthesize_text(text: str):
         sys.exit(1)
 
     try:
-        tts = TTS(model_id)
-        wav = tts.tts(text)
-        # Coqui returns float32 PCM [-1, 1]
-        sr = getattr(tts, "output_sample_rate", None) or getattr(tts, "sample_rate", 22050)
-        wav = np.asarray(wav, dtype=np.float32)
-        if wav.ndim > 1:
-            wav = np.mean(wav, axis=1).astype(np.float32)
-        return wav, int(sr)
+        return TTS(model_id, gpu=_want_gpu())
     except Exception as ex:
-        eprint(json.dumps({"error": f"TTS synthesis failed: {ex}"}))
+        eprint(json.dumps({"error": f"TTS model load failed: {ex}"}))
         sys.exit(1)
 
-def float_to_int16_bytes(wav_f32: np.ndarray) -> bytes:
-    wav = np.clip(wav_f32, -1.0, 1.0)
-    wav_i16 = (wav * 32767.0).astype(np.int16)
-    return wav_i16.tobytes()
+def _synthesize(tts, text: str):
+    wav = tts.tts(text)
+    # Coqui returns float32 PCM [-1, 1]
+    sr = getattr(tts, "output_sample_rate", None) or getattr(tts, "sample_rate", 22050)
+    wav = np.asarray(wav, dtype=np.float32)
+    if wav.ndim > 1:
+        wav = np.mean(wav, axis=1).astype(np.float32)
+    return wav, int(sr)
+
+def split_sentences(text: str):
+    return [s for s in SENTENCE_SPLIT.split(text) if s.strip()]
+
+# Reused int16 staging buffer (this script is single-threaded); grows on demand
+_SCRATCH_I16 = np.empty(22050 * 30, dtype=np.int16)
 
-def start_ffmpeg_encoder(in_sr: int):
+def float_to_int16_bytes(wav_f32: np.ndarray) -> bytes:
     """
-    Launch ffmpeg to read 16-bit mono PCM on stdin and write MP3 on stdout.
+    Scale + clip in place on the (caller-owned) float32 buffer, then one cast pass
+    into the reused int16 scratch buffer.
     """
-    cmd = [
-        "ffmpeg",
-        "-hide_banner",
-        "-loglevel", "error",
-        "-f", "s16le",
-        "-ar", str(in_sr),
-        "-ac", "1",
-        "-i", "pipe:0",
-        # Output MP3
-        "-f", "mp3",
-        "-b:a", os.environ.get("TTS_MP3_BITRATE", "128k"),
-        "-ar", os.environ.get("TTS_MP3_RATE", "22050"),
-        "pipe:1",
-    ]
+    global _SCRATCH_I16
+    wav = np.asarray(wav_f32, dtype=np.float32)
+    n = wav.shape[0]
+    if n > _SCRATCH_I16.shape[0]:
+        _SCRATCH_I16 = np.empty(n, dtype=np.int16)
+    np.multiply(wav, 32767.0, out=wav)
+    np.clip(wav, -32767.0, 32767.0, out=wav)
+    out = _SCRATCH_I16[:n]
+    np.copyto(out, wav, casting="unsafe")
+    return out.tobytes()
+
+def mp3_bitrate_kbps() -> int:
+    raw = os.environ.get("TTS_MP3_BITRATE", "128k").strip().lower().rstrip("k")
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            bufsize=0,
-        )
-        return proc
-    except FileNotFoundError:
-        eprint(json.dumps({"error": "ffmpeg not found. Install with: apt-get update && apt-get install -y ffmpeg"}))
-        sys.exit(1)
+        return int(raw)
+    except ValueError:
+        return 128
 
-def write_stdout_streaming(ffmpeg_proc, chunk_size=16384):
+def create_mp3_encoder(in_sr: int):
     """
-    Relay ffmpeg stdout to our stdout (binary) in chunks for streaming.
+    In-process LAME encoder for 16-bit mono PCM (no ffmpeg fork/exec or pipe copies).
     """
-    out = ffmpeg_proc.stdout
-    dest = sys.stdout.buffer
     try:
-        while True:
-            chunk = out.read(chunk_size)
-            if not chunk:
-                break
-            dest.write(chunk)
-            dest.flush()
-    except BrokenPipeError:
-        # Client went away; just stop
-        pass
+        import lameenc
     except Exception as ex:
-        eprint(json.dumps({"error": f"stdout relay error: {ex}"}))
+        eprint(json.dumps({"error": f"lameenc not installed: {ex}. Install with: pip install lameenc"}))
+        sys.exit(1)
+
+    enc = lameenc.Encoder()
+    enc.set_bit_rate(mp3_bitrate_kbps())
+    enc.set_in_sample_rate(in_sr)
+    enc.set_channels(1)
+    enc.set_quality(5)
+    return enc
+
+def create_resampler(in_sr: int):
+    """
+    Return (resample(wav, last=False), out_sr) taking synthesis rate -> TTS_MP3_RATE.
+    Uses a streaming soxr resampler so sentence boundaries stay continuous.
+    """
+    out_sr = int(os.environ.get("TTS_MP3_RATE", "22050"))
+    if out_sr == in_sr:
+        return (lambda wav, last=False: wav), in_sr
+    if soxr is None:
+        eprint(f"[tts.py] soxr not installed; encoding at synthesis rate {in_sr}")
+        return (lambda wav, last=False: wav), in_sr
+    stream = soxr.ResampleStream(in_sr, out_sr, 1, dtype="float32")
+    return (lambda wav, last=False: stream.resample_chunk(wav, last=last)), out_sr
+
+def iter_mp3(tts, text: str):
+    """
+    Yield MP3 bytes sentence by sentence so the first frames leave before the
+    whole utterance is done. One encoder spans all sentences to keep frames valid.
+    """
+    enc = None
+    for sentence in split_sentences(text) or [text]:
+        wav_f32, sr = _synthesize(tts, sentence)
+        if enc is None:
+            resample, out_sr = create_resampler(sr)
+            enc = create_mp3_encoder(out_sr)
+        mp3 = enc.encode(float_to_int16_bytes(resample(wav_f32)))
+        if mp3:
+            yield mp3
+    tail = resample(np.zeros(0, dtype=np.float32), last=True)
+    yield enc.encode(float_to_int16_bytes(tail)) + enc.flush()
+
+def write_mp3(tts, path: str, text: str):
+    out = b"".join(iter_mp3(tts, text))
+    with open(path, "wb") as f:
+        f.write(out)
+
+def run_batch():
+    """
+    Read "output_path<TAB>text" lines from stdin and write one MP3 per line,
+    keeping the model loaded for the whole run. Replies "OK<TAB>path" or
+    "ERR<TAB>path<TAB>message" per line on stdout.
+    """
+    tts = load_tts()
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        path, sep, text = line.partition("\t")
+        try:
+            if not sep or not text.strip():
+                raise ValueError("expected output_path<TAB>text")
+            write_mp3(tts, path, text.strip())
+            print(f"OK\t{path}")
+        except Exception as ex:
+            eprint(json.dumps({"error": f"batch synthesis failed for {path}: {ex}"}))
+            print(f"ERR\t{path}\t{ex}")
+        sys.stdout.flush()
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--stream", action="store_true", help="stream MP3 to stdout in chunks")
+    parser.add_argument("--batch", action="store_true", help="read output_path<TAB>text lines on stdin, write MP3 files")
     args = parser.parse_args()
 
+    if args.batch:
+        run_batch()
+        return
+
     # Read the entire prompt from stdin (Node writes it)
     try:
         text = sys.stdin.read()
@@ -114,56 +189,34 @@ def main():
     if not text:
         text = "Hello. This is a test of the Holly text to speech system."
 
-    # Synthesize to float32 PCM
-    wav_f32, sr = synthesize_text(text)
-    pcm_bytes = float_to_int16_bytes(wav_f32)
-
-    # Encode MP3 via ffmpeg
-    proc = start_ffmpeg_encoder(sr)
-
-    # STREAMING: relay ffmpeg stdout while feeding stdin
-    if args.stream:
-        # Start a reader thread to relay encoded MP3 to client as it is produced
-        relay_thread = threading.Thread(target=write_stdout_streaming, args=(proc,))
-        relay_thread.daemon = True
-        relay_thread.start()
-
-        try:
-            # Write PCM to ffmpeg in chunks
-            stdin = proc.stdin
-            mv = memoryview(pcm_bytes)
-            step = 16384
-            for i in range(0, len(mv), step):
-                part = mv[i:i+step]
-                stdin.write(part)
-            stdin.close()
-        except BrokenPipeError:
-            # Client gone or encoder failed
-            pass
-        except Exception as ex:
-            eprint(json.dumps({"error": f"ffmpeg stdin write error: {ex}"}))
-        finally:
-            proc.wait()
-            relay_thread.join()
-
-        # Exit with ffmpeg's code so the caller can detect failure if needed
-        sys.exit(proc.returncode or 0)
+    tts = load_tts()
+    dest = sys.stdout.buffer
+    out = bytearray()
 
-    # NON-STREAMING: feed all PCM, collect all MP3, then write once
     try:
-        out, err = proc.communicate(input=pcm_bytes)
+        for mp3 in iter_mp3(tts, text):
+            if args.stream:
+                dest.write(mp3)
+                dest.flush()
+            else:
+                out += mp3
+    except BrokenPipeError:
+        # Client went away; just stop
+        return
     except Exception as ex:
-        eprint(json.dumps({"error": f"ffmpeg communicate error: {ex}"}))
+        eprint(json.dumps({"error": f"TTS synthesis failed: {ex}"}))
         sys.exit(1)
 
-    if proc.returncode != 0 or not out:
-        eprint(err.decode("utf-8", errors="ignore"))
-        eprint(json.dumps({"error": f"ffmpeg failed (code={proc.returncode})"}))
+    if args.stream:
+        return
+
+    if not out:
+        eprint(json.dumps({"error": "mp3 encoder produced no output"}))
         sys.exit(1)
 
     try:
-        sys.stdout.buffer.write(out)
-        sys.stdout.buffer.flush()
+        dest.write(out)
+        dest.flush()
     except BrokenPipeError:
         pass
 
@@ -1,16 +1,30 @@
+import functools
+import hashlib
 import io
-import wave
+import itertools
+import json
 import logging
 import os
 import time
 import asyncio
+import queue
+import threading
 import struct
 import re
+from collections import OrderedDict
+from concurrent.futures import Future
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import Response, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import numpy as np
 
+TTS_THREADS = max(1, int(os.getenv("TTS_THREADS", "1")))  # CPU intra-op threads
+
+if os.getenv("TTS_DEVICE", "auto").lower() == "cpu":
+    # OpenMP/MKL read these once, when torch first spins up its pools
+    os.environ.setdefault("OMP_NUM_THREADS", str(TTS_THREADS))
+    os.environ.setdefault("MKL_NUM_THREADS", str(TTS_THREADS))
+
 try:  # Optional heavy dependency
     from TTS.api import TTS as CoquiTTS  # type: ignore
 except Exception:  # pragma: no cover
@@ -28,6 +42,34 @@ try:  # torch is optional
 except Exception:  # pragma: no cover
     torch = None
 
+if torch is not None:
+    # The decoder is many tiny LSTM steps over shifting lengths: cuDNN autotuning
+    # re-benchmarks instead of helping. TF32 covers the fp32 ops autocast leaves.
+    torch.backends.cudnn.benchmark = False
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.set_float32_matmul_precision("high")
+
+try:  # Optional CPU runtime for the Tacotron2 convolution stacks
+    import onnxruntime as ort  # type: ignore
+except Exception:  # pragma: no cover
+    ort = None
+
+try:  # Optional fast JSON encoder for the probe endpoints
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:  # Optional SIMD resampler for speed changes
+    import soxr  # type: ignore
+except Exception:  # pragma: no cover
+    soxr = None
+
+try:  # scipy polyphase fallback when soxr is missing
+    from scipy.signal import resample_poly  # type: ignore
+except Exception:  # pragma: no cover
+    resample_poly = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tts_server")
 
@@ -35,6 +77,12 @@ logger = logging.getLogger("tts_server")
 MODEL_ID = os.getenv("TTS_MODEL", "tts_models/en/ek1/tacotron2")
 DEFAULT_SPEED = float(os.getenv("TTS_SPEED", "1.12"))
 TTS_DEVICE = os.getenv("TTS_DEVICE", "auto").lower()
+TTS_COMPILE = os.getenv("TTS_COMPILE", "0") == "1"  # torch.compile Tacotron2 on CUDA
+TTS_ONNX = os.getenv("TTS_ONNX", "0") == "1"  # ONNX Runtime encoder/postnet on CPU
+TTS_INT8 = os.getenv("TTS_INT8", "0") == "1"  # dynamic int8 LSTM/Linear on CPU (lossy)
+TTS_AMP = os.getenv("TTS_AMP", "0") == "1"  # CUDA autocast; often slower for Tacotron2
+TTS_D2H_INT16 = os.getenv("TTS_D2H_INT16", "0") == "1"  # int16 over PCIe (may shift 1 LSB)
+TTS_FP16 = os.getenv("TTS_FP16", "0") == "1"  # fp16 vocoder weights on CUDA
 # ==============================================================================
 
 def _init_tts():
@@ -56,10 +104,16 @@ if tts is None:
         def __init__(self, sr: int = 22050):
             self.sample_rate = sr
             self.device = "cpu"
+            self._omega = np.float32(2 * np.pi * 440 / sr)  # rad/sample
         def tts(self, text: str):
             duration = max(1.2, len(text) * 0.06)
-            t = np.linspace(0, duration, int(self.sample_rate * duration), endpoint=False)
-            return 0.2 * np.sin(2 * np.pi * 440 * t)
+            n = int(self.sample_rate * duration)
+            # float32 throughout, one output buffer reused for phase -> sin -> gain
+            wav = np.arange(n, dtype=np.float32)
+            np.multiply(wav, self._omega, out=wav)
+            np.sin(wav, out=wav)
+            np.multiply(wav, np.float32(0.2), out=wav)
+            return wav
     tts = DummyTTS()
 
 want_cuda = TTS_DEVICE in ("auto", "cuda")
@@ -75,6 +129,327 @@ elif TTS_DEVICE == "cuda" and not cuda_avail:
     logger.warning("CUDA requested but unavailable, using CPU")
 tts.device = device_used
 
+def _performance_cores() -> set[int] | None:
+    """CPU ids of the P-cores on a hybrid (Intel P/E) Linux host, else None."""
+    try:
+        with open("/sys/devices/cpu_core/cpus") as fh:
+            spec = fh.read().strip()
+    except OSError:
+        return None
+    cpus: set[int] = set()
+    for part in filter(None, spec.split(",")):
+        lo, _, hi = part.partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    return cpus or None
+
+if torch is not None and device_used != "cuda":
+    # Intra-op threads contend badly on the small Tacotron2 matmuls; keep few
+    torch.set_num_threads(TTS_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError as ex:  # only allowed before any parallel work ran
+        logger.warning("Could not set interop threads: %s", ex)
+    logger.info(
+        "TTS cpu threads intra=%s interop=%s OMP_NUM_THREADS=%s MKL_NUM_THREADS=%s",
+        torch.get_num_threads(),
+        torch.get_num_interop_threads(),
+        os.getenv("OMP_NUM_THREADS"),
+        os.getenv("MKL_NUM_THREADS"),
+    )
+    # Keep the decode loop off E-cores, which would set the pace for every step
+    p_cores = _performance_cores() if os.getenv("TTS_PIN_PCORES", "1") == "1" else None
+    if p_cores and hasattr(os, "sched_setaffinity"):
+        allowed = os.sched_getaffinity(0) & p_cores
+        if allowed:
+            os.sched_setaffinity(0, allowed)
+            logger.info("TTS pinned to performance cores %s", sorted(allowed))
+
+def _cast_floats(obj, dtype):
+    """Cast floating tensors in (nested) args/outputs; leaves ids and everything else alone."""
+    if torch.is_tensor(obj):
+        return obj.to(dtype) if obj.is_floating_point() else obj
+    if isinstance(obj, dict):
+        return {k: _cast_floats(v, dtype) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cast_floats(v, dtype) for v in obj)
+    return obj
+
+def _halve_vocoder(engine) -> bool:
+    """Run the vocoder in fp16 on CUDA; reverts to fp32 if a test synthesis fails."""
+    vocoder = getattr(getattr(engine, "synthesizer", None), "vocoder_model", None)
+    inference = getattr(vocoder, "inference", None)
+    if inference is None:
+        return False
+
+    def half_inference(*args, **kwargs):
+        out = inference(*_cast_floats(args, torch.float16), **_cast_floats(kwargs, torch.float16))
+        return _cast_floats(out, torch.float32)
+
+    vocoder.half()
+    vocoder.inference = half_inference
+    try:
+        with torch.inference_mode():
+            engine.tts("fp16 check.")
+    except Exception as ex:
+        logger.warning("fp16 vocoder failed a test synthesis, reverting to fp32: %s", ex)
+        vocoder.float()
+        vocoder.inference = inference
+        return False
+    logger.info("TTS fp16 vocoder weights")
+    return True
+
+if TTS_FP16 and device_used == "cuda":
+    try:
+        _halve_vocoder(tts)
+    except Exception as ex:
+        logger.warning("fp16 conversion failed: %s", ex)
+
+# bf16 on Ampere+ (same tensor-core speed, fp32 range: no softmax overflow/NaNs);
+# Volta/Turing have no fast bf16, so they keep fp16
+AUTOCAST_DTYPE = None
+if device_used == "cuda" and TTS_AMP:
+    try:
+        major, _ = torch.cuda.get_device_capability()
+        AUTOCAST_DTYPE = torch.bfloat16 if major >= 8 else torch.float16
+    except Exception as ex:
+        logger.warning("Could not read CUDA capability, using fp16 autocast: %s", ex)
+        AUTOCAST_DTYPE = torch.float16
+    logger.info("TTS autocast dtype=%s", AUTOCAST_DTYPE)
+
+def _compile_tacotron(engine) -> bool:
+    """torch.compile the Tacotron2 encoder, decoder step, postnet and vocoder in place.
+
+    Default mode, no CUDA graphs: Coqui appends each decoder step's outputs to a
+    list, and a replayed graph would overwrite them in its static buffers.
+    Methods are compiled rather than whole modules: Coqui calls
+    tts_model.inference(), which a compiled module wrapper would pass straight
+    through to eager code. A test synthesis compiles them; on failure the
+    eager methods are put back and False is returned.
+    """
+    synthesizer = getattr(engine, "synthesizer", None)
+    model = getattr(synthesizer, "tts_model", None)
+    if model is None or torch is None or not hasattr(torch, "compile"):
+        return False
+    targets = [
+        (getattr(model, "encoder", None), "encoder", "forward"),
+        (getattr(model, "decoder", None), "decoder", "decode"),
+        (getattr(model, "postnet", None), "postnet", "forward"),
+        (getattr(synthesizer, "vocoder_model", None), "vocoder", "forward"),
+    ]
+    originals = []
+    for mod, mod_name, fn_name in targets:
+        fn = getattr(mod, fn_name, None)
+        if fn is None:
+            continue
+        originals.append((mod, mod_name, fn_name, fn))
+        setattr(mod, fn_name, torch.compile(fn, fullgraph=False))
+    if not originals:
+        return False
+    try:
+        with torch.inference_mode():
+            engine.tts("compile check.")
+    except Exception as ex:
+        logger.warning("Compiled Tacotron2 failed a test synthesis, staying eager: %s", ex)
+        for mod, _, fn_name, fn in originals:
+            setattr(mod, fn_name, fn)
+        return False
+    logger.info("TTS compiled modules: %s", ", ".join(f"{m}.{f}" for _, m, f, _ in originals))
+    return True
+
+def _onnx_offload(engine) -> list[str]:
+    """Run the Tacotron2 encoder and postnet through ONNX Runtime (CPU only).
+
+    Both are conv stacks over the whole sequence, so they export cleanly with a
+    dynamic time axis. The autoregressive decoder stays in torch: its state
+    lives on the module and one ORT call per frame would eat the gain. If an
+    export or a test synthesis fails, the torch methods are put back.
+    """
+    model = getattr(getattr(engine, "synthesizer", None), "tts_model", None)
+    if model is None or torch is None or ort is None:
+        return []
+
+    class _Call(torch.nn.Module):
+        def __init__(self, fn):
+            super().__init__()
+            self.fn = fn
+        def forward(self, x):
+            return self.fn(x)
+
+    def _in_channels(mod) -> int:
+        return mod.convolutions[0].convolution1d.in_channels
+
+    def _session(fn, channels: int, out_time_axis: int):
+        buf = io.BytesIO()
+        torch.onnx.export(
+            _Call(fn).eval(), torch.randn(1, channels, 32), buf,
+            input_names=["x"], output_names=["y"], opset_version=17,
+            dynamic_axes={"x": {2: "seq"}, "y": {out_time_axis: "seq"}},
+        )
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads = 1
+        opts.inter_op_num_threads = 1
+        sess = ort.InferenceSession(buf.getvalue(), opts, providers=["CPUExecutionProvider"])
+
+        def run(x):
+            y = sess.run(None, {"x": x.detach().to("cpu", torch.float32).numpy()})[0]
+            return torch.from_numpy(y)
+        return run
+
+    originals = []
+    try:
+        with torch.no_grad():
+            encoder = getattr(model, "encoder", None)
+            if encoder is not None and hasattr(encoder, "inference"):
+                originals.append((encoder, "encoder", "inference", encoder.inference))
+                encoder.inference = _session(encoder.inference, _in_channels(encoder), 1)  # -> [B, T, C]
+            postnet = getattr(model, "postnet", None)
+            if postnet is not None:
+                originals.append((postnet, "postnet", "forward", postnet.forward))
+                postnet.forward = _session(postnet.forward, _in_channels(postnet), 2)  # -> [B, C, T]
+        if originals:
+            with torch.inference_mode():
+                engine.tts("onnx check.")
+    except Exception:
+        for mod, _, fn_name, fn in originals:
+            setattr(mod, fn_name, fn)
+        raise
+    offloaded = [name for _, name, _, _ in originals]
+    if offloaded:
+        logger.info("TTS onnxruntime modules: %s", ", ".join(offloaded))
+    return offloaded
+
+def _quantize_int8(engine) -> bool:
+    """Swap the Tacotron2 LSTM/Linear layers for FBGEMM/QNNPACK int8 kernels in place.
+
+    Weights are quantized once; activations are quantized per call, so no
+    calibration pass is needed.
+    """
+    model = getattr(getattr(engine, "synthesizer", None), "tts_model", None)
+    if model is None or torch is None:
+        return False
+    quantize_dynamic = getattr(getattr(torch, "ao", torch).quantization, "quantize_dynamic")
+    quantize_dynamic(
+        model, {torch.nn.LSTM, torch.nn.LSTMCell, torch.nn.Linear}, dtype=torch.qint8, inplace=True,
+    )
+    logger.info("TTS int8 dynamic quantization applied")
+    return True
+
+def _clamp_vocoder_output(engine) -> bool:
+    """Clamp the vocoder waveform to [-1, 1] in place on the GPU, before Coqui's .cpu() copy."""
+    vocoder = getattr(getattr(engine, "synthesizer", None), "vocoder_model", None)
+    inference = getattr(vocoder, "inference", None)
+    if inference is None or torch is None:
+        return False
+
+    def clamped_inference(*args, **kwargs):
+        out = inference(*args, **kwargs)
+        return out.clamp_(-1.0, 1.0) if torch.is_tensor(out) else out
+
+    vocoder.inference = clamped_inference
+    return True
+
+def _pin_vocoder_output(engine, seconds: int = 30, int16_transfer: bool = False) -> bool:
+    """Land the vocoder waveform in one reused pinned host buffer, optionally sent as int16."""
+    synthesizer = getattr(engine, "synthesizer", None)
+    vocoder = getattr(synthesizer, "vocoder_model", None)
+    inference = getattr(vocoder, "inference", None)
+    if inference is None or torch is None:
+        return False
+    sr = int(getattr(synthesizer, "output_sample_rate", 22050))
+    dtype = torch.int16 if int16_transfer else torch.float32
+    size = seconds * sr
+    staging = {"buf": torch.empty(size, dtype=dtype, pin_memory=True)}
+    if int16_transfer:
+        staging["f32"] = torch.empty(size, dtype=torch.float32)
+
+    def pinned_inference(*args, **kwargs):
+        out = inference(*args, **kwargs)
+        if not torch.is_tensor(out) or not out.is_cuda:
+            return out
+        n = out.numel()
+        if n > staging["buf"].numel():
+            staging["buf"] = torch.empty(n, dtype=dtype, pin_memory=True)
+            if int16_transfer:
+                staging["f32"] = torch.empty(n, dtype=torch.float32)
+        host = staging["buf"][:n].view(out.shape)
+        src = out.mul(32767.0).round_().to(torch.int16) if int16_transfer else out.float()
+        host.copy_(src, non_blocking=True)
+        torch.cuda.current_stream().synchronize()
+        if not int16_transfer:
+            return host
+        wide = staging["f32"][:n].view(out.shape)
+        return torch.mul(host, 1.0 / 32767.0, out=wide)
+
+    vocoder.inference = pinned_inference
+    return True
+
+def _cache_tokenizer(engine):
+    """Memoize Coqui's pure-Python text -> token ids frontend (phonemizer etc).
+
+    Returns the cached callable, or None when the engine has no tokenizer.
+    """
+    model = getattr(getattr(engine, "synthesizer", None), "tts_model", None)
+    tokenizer = getattr(model, "tokenizer", None)
+    text_to_ids = getattr(tokenizer, "text_to_ids", None)
+    if text_to_ids is None:
+        return None
+    # Ids are cached unpadded on purpose: Tacotron2.inference takes no lengths or
+    # mask, so padding to length buckets would bleed into the encoder and stop check
+    cached = functools.lru_cache(maxsize=1024)(lambda text, language=None: tuple(text_to_ids(text, language)))
+
+    def cached_text_to_ids(text, language=None):
+        return list(cached(text, language))  # callers get their own list
+
+    tokenizer.text_to_ids = cached_text_to_ids
+    return cached_text_to_ids
+
+TEXT_TO_IDS = _cache_tokenizer(tts)
+GPU_CLAMPED = device_used == "cuda" and _clamp_vocoder_output(tts)
+if device_used == "cuda":
+    try:
+        # int16 over PCIe only once clamped, or out-of-range samples would wrap
+        _pin_vocoder_output(tts, int16_transfer=GPU_CLAMPED and TTS_D2H_INT16)
+    except Exception as ex:
+        logger.warning("Pinned staging buffer unavailable: %s", ex)
+
+def pretokenize(texts: list[str]) -> None:
+    """Fill the token cache ahead of the inference worker (runs off the GPU path).
+
+    Coqui tokenizes per sentence after its own split, so the same split is
+    applied here; whole chunks would fill keys the worker never looks up.
+    """
+    if TEXT_TO_IDS is None:
+        return
+    split = getattr(getattr(tts, "synthesizer", None), "split_into_sentences", None)
+    for text in texts:
+        try:
+            for sentence in split(text) if split is not None else (text,):
+                TEXT_TO_IDS(sentence)
+        except Exception:
+            return
+
+ONNX_MODULES: list[str] = []
+if TTS_ONNX and device_used == "cpu":
+    try:
+        ONNX_MODULES = _onnx_offload(tts)
+    except Exception as ex:
+        logger.warning("ONNX offload failed, staying on torch: %s", ex)
+
+QUANTIZED = False
+if TTS_INT8 and device_used == "cpu":
+    try:
+        QUANTIZED = _quantize_int8(tts)
+    except Exception as ex:
+        logger.warning("int8 quantization failed, staying fp32: %s", ex)
+
+COMPILED = False
+if TTS_COMPILE and device_used == "cuda":
+    try:
+        COMPILED = _compile_tacotron(tts)
+    except Exception as ex:
+        logger.warning("torch.compile failed, staying eager: %s", ex)
+
 DEFAULT_SR = int(getattr(tts, "output_sample_rate", getattr(tts, "sample_rate", 22050)))
 
 torch_version = getattr(torch, "__version__", "none")
@@ -84,6 +459,15 @@ device_name = (
     torch.cuda.get_device_name(current_device) if cuda_avail and torch else None
 )
 
+if torch is not None:
+    logger.info(
+        "TTS torch backends cudnn.benchmark=%s tf32 matmul=%s cudnn=%s matmul_precision=%s",
+        torch.backends.cudnn.benchmark,
+        torch.backends.cuda.matmul.allow_tf32,
+        torch.backends.cudnn.allow_tf32,
+        torch.get_float32_matmul_precision(),
+    )
+
 logger.info(
     "TTS init model=%s device=%s torch=%s cuda_avail=%s cuda_count=%s current_device=%s device_name=%s sr=%s init_ms=%s speed=%.3f",
     MODEL_ID,
@@ -105,42 +489,69 @@ class SpeakRequest(BaseModel):
     sample_rate: int | None = None
     stream: bool | None = False
     speed: float | None = None  # >1.0 = faster
+    framing: str | None = None  # stream only: wav-len-prefixed | wav-streaming-raw
 
-def _apply_speed(wav: np.ndarray, speed: float) -> np.ndarray:
-    if speed is None or abs(speed - 1.0) < 1e-3:
+def _apply_speed(wav: np.ndarray, speed: float, sr: int = DEFAULT_SR, out_sr: int | None = None) -> np.ndarray:
+    out_sr = sr if out_sr is None else out_sr
+    speed = 1.0 if speed is None else max(0.5, min(2.0, float(speed)))
+    if abs(speed - 1.0) < 1e-3 and out_sr == sr:
         return wav
-    speed = max(0.5, min(2.0, float(speed)))
+    # Resample sr -> out_sr/speed and play at out_sr: speed change and output rate
+    # in one pass. Band-limited polyphase filters avoid the aliasing linear
+    # interpolation produces for speed > 1
+    if soxr is not None:
+        return soxr.resample(wav, sr, int(round(out_sr / speed)), quality="HQ").astype(np.float32, copy=False)
+    if resample_poly is not None:
+        # resample_poly reduces up/down by their gcd
+        return resample_poly(wav, up=1000 * out_sr, down=int(round(1000 * sr * speed))).astype(np.float32, copy=False)
     n = wav.shape[0]
-    new_n = max(1, int(n / speed))
+    new_n = max(1, int(n * out_sr / (sr * speed)))
     x_old = np.arange(n, dtype=np.float64)
     x_new = np.linspace(0, n - 1, new_n, dtype=np.float64)
     return np.interp(x_new, x_old, wav).astype(np.float32)
 
-def synthesize(text: str, speed: float | None = None) -> np.ndarray:
+def _autocast_ctx():
+    # New torch.amp API; older torch only has the deprecated torch.cuda.amp one
+    amp = getattr(torch, "amp", None)
+    if amp is not None and hasattr(amp, "autocast"):
+        return amp.autocast("cuda", dtype=AUTOCAST_DTYPE)
+    return torch.cuda.amp.autocast(dtype=AUTOCAST_DTYPE)
+
+def synthesize(text: str, speed: float | None = None, sr: int = DEFAULT_SR) -> np.ndarray:
     if torch is not None:
+        # No autocast on CPU (it only adds casts there); on CUDA only with TTS_AMP=1
         with torch.inference_mode():
-            if getattr(tts, "device", "cpu") == "cuda":
-                try:
-                    from torch.amp import autocast
-                    autocast_ctx = autocast("cuda")
-                except Exception:
-                    from torch.cuda.amp import autocast
-                    autocast_ctx = autocast()
-                with autocast_ctx:
+            if AUTOCAST_DTYPE is not None:
+                with _autocast_ctx():
                     y = tts.tts(text)
             else:
                 y = tts.tts(text)
     else:
         y = tts.tts(text)
-    wav = np.asarray(y, dtype=np.float32)
-    if wav.ndim > 1:
-        wav = np.mean(wav, axis=1).astype(np.float32)
+    if isinstance(y, np.ndarray) and y.dtype == np.float32 and y.ndim == 1:
+        wav = y  # Tacotron2 / dummy output: already mono float32
+    elif isinstance(y, list):
+        # Coqui's Synthesizer returns a flat list of scalars; fromiter with a known
+        # count fills one float32 buffer without asarray's per-item shape discovery
+        wav = np.fromiter(y, dtype=np.float32, count=len(y))
+    else:
+        wav = np.asarray(y, dtype=np.float32)
+        if wav.ndim > 1:
+            wav = np.mean(wav, axis=1, dtype=np.float32)
     thr = 0.0025
-    nz = np.where(np.abs(wav) > thr)[0]
-    if nz.size > 0:
-        wav = wav[nz[0]: nz[-1] + 1]
+    # Bool mask + argmax from each end: no int64 index array of every loud sample
+    mask = np.abs(wav) > thr
+    if mask.any():
+        start = int(np.argmax(mask))
+        end = mask.shape[0] - int(np.argmax(mask[::-1]))
+        wav = wav[start:end]
     eff_speed = speed if speed is not None else DEFAULT_SPEED
-    return _apply_speed(wav, eff_speed)
+    trimmed = wav
+    wav = _apply_speed(wav, eff_speed, out_sr=sr)
+    # Callers rely on [-1, 1]; resampling can ring past the GPU clamp
+    if wav is not trimmed or not GPU_CLAMPED:
+        np.clip(wav, -1.0, 1.0, out=wav)
+    return wav
 
 WARMED_UP = False
 try:
@@ -152,4 +563,360 @@ try:
 except Exception as ex:
     logger.warning("TTS warmup failed: %s", ex)
 
-# … rest of your original /speak, /speak_debug, /health, /env_debug endpoints remain unchanged …
+# Longer inputs hit kernel/allocator paths "warmup" never touches; pay for them
+# now so the first real sentence doesn't. A failure here leaves WARMED_UP alone.
+WARMUP_TEXTS = (
+    "hello world.",
+    "the quick brown fox jumps over the lazy dog, and then some more text for a longer pass.",
+)
+if WARMED_UP and device_used == "cuda":
+    for warm_text in WARMUP_TEXTS:
+        try:
+            warm_start = time.perf_counter()
+            synthesize(warm_text, speed=DEFAULT_SPEED)
+            logger.info("TTS warmup chars=%s warmup_ms=%s", len(warm_text),
+                        int((time.perf_counter() - warm_start) * 1000))
+        except Exception as ex:
+            logger.warning("TTS warmup chars=%s failed: %s", len(warm_text), ex)
+            break
+
+# === WAV / PCM helpers =========================================================
+STREAM_FRAMING = "wav-len-prefixed"  # u32 big-endian length + mini-WAV per chunk
+STREAM_FRAMING_RAW = "wav-streaming-raw"  # one open-ended WAV header, then bare PCM
+# Default stays length-prefixed: that is what routes/tts.js clients parse
+DEFAULT_FRAMING = os.getenv("TTS_STREAM_FRAMING", STREAM_FRAMING)
+if DEFAULT_FRAMING not in (STREAM_FRAMING, STREAM_FRAMING_RAW):
+    logger.warning("Unknown TTS_STREAM_FRAMING=%s, using %s", DEFAULT_FRAMING, STREAM_FRAMING)
+    DEFAULT_FRAMING = STREAM_FRAMING
+# Output rates /speak resamples to; outside this range the header fields are nonsense
+MIN_SR, MAX_SR = 8000, 48000
+LONG_TEXT_CHARS = int(os.getenv("TTS_LONG_TEXT_CHARS", "320"))
+CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "160"))
+STREAM_BATCH = max(1, int(os.getenv("TTS_STREAM_BATCH", "4")))
+AUDIO_CACHE_SIZE = int(os.getenv("TTS_CACHE_SIZE", "256"))  # PCM entries, 0 disables
+# Only short phrases ("okay", "one moment") repeat often enough to be worth keeping
+CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "120"))
+
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")  # canonical 44-byte PCM header
+
+def make_wav_header(data_len: int, sample_rate: int = DEFAULT_SR, channels: int = 1,
+                    bits_per_sample: int = 16) -> bytes:
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return _WAV_HEADER.pack(
+        b"RIFF", 36 + data_len, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample,
+        b"data", data_len,
+    )
+
+@functools.lru_cache(maxsize=8)
+def wav_header_template(sample_rate: int = DEFAULT_SR) -> bytes:
+    """Mono int16 header with zeroed lengths; stream_frame patches the two length fields.
+
+    Non-stream responses keep make_wav_header: one precompiled Struct.pack
+    beats copying this template and doing two pack_into calls.
+    """
+    return make_wav_header(0, sample_rate)
+
+_HDR_TEMPLATE = wav_header_template(DEFAULT_SR)
+
+def streaming_wav_header(sample_rate: int = DEFAULT_SR) -> bytes:
+    """Header for a WAV of unknown length: both size fields 0xFFFFFFFF."""
+    buf = bytearray(wav_header_template(sample_rate))
+    struct.pack_into("<I", buf, 4, 0xFFFFFFFF)
+    struct.pack_into("<I", buf, 40, 0xFFFFFFFF)
+    return bytes(buf)
+
+_I16_SCALE = np.float32(32767.0)
+
+def _f32_to_i16(wav: np.ndarray, preclipped: bool = False, out: np.ndarray | None = None) -> np.ndarray:
+    """float32 [-1, 1] -> int16: scale fused into the int16 store.
+
+    Clips first unless the caller guarantees the range (`preclipped`). Writes
+    into `out` (int16, at least len(wav)) when given and returns that slice.
+    """
+    src = np.asarray(wav, dtype=np.float32)
+    if not preclipped:
+        src = np.clip(src, -1.0, 1.0)
+    n = src.shape[0]
+    dst = np.empty(n, dtype=np.int16) if out is None else out[:n]
+    # float32 multiply and saturated-range store in one ufunc pass, no float temp
+    np.multiply(src, _I16_SCALE, out=dst, casting="unsafe")
+    return dst
+
+# Per-thread int16 scratch, grown to the longest chunk seen; tobytes() copies out,
+# so the buffer never escapes and needs no reallocation per request
+_pcm_scratch = threading.local()
+
+# Only ever fed synthesize() output, which is already clamped
+def float32_to_pcm_bytes(wav: np.ndarray) -> bytes:
+    n = len(wav)
+    buf = getattr(_pcm_scratch, "buf", None)
+    if buf is None or buf.shape[0] < n:
+        buf = _pcm_scratch.buf = np.empty(max(n, 2 * (0 if buf is None else buf.shape[0])), dtype=np.int16)
+    return _f32_to_i16(wav, preclipped=True, out=buf).tobytes()
+
+def stream_frame(template: bytes, pcm: bytes) -> bytes:
+    """One length-prefixed mini-WAV frame, returned as a single bytes object.
+
+    Layout: u32 BE frame length | 44-byte header | int16 PCM, so the stream
+    generator does one write per chunk instead of prefix + frame. Only the
+    48-byte head is patched; the join copies the PCM exactly once.
+    """
+    hdr_len = len(template)
+    head = bytearray(4 + hdr_len)
+    struct.pack_into(">I", head, 0, hdr_len + len(pcm))
+    head[4:] = template
+    struct.pack_into("<I", head, 4 + 4, 36 + len(pcm))
+    struct.pack_into("<I", head, 4 + 40, len(pcm))
+    return b"".join((head, pcm))
+
+_SENT_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+def chunk_text(text: str, limit: int = CHUNK_CHARS) -> list[str]:
+    """Greedy-pack sentences into chunks of at most ~limit chars.
+
+    One finditer pass over sentence breaks. Sentences are joined by a single
+    space and counted that way, so a run of spaces or newlines between them
+    neither lands in a chunk nor eats into the limit.
+    """
+    text = text.strip()
+    chunks: list[str] = []
+    sent_start = 0  # where the current sentence starts
+    chunk_start = chunk_end = 0  # span of the chunk being packed
+    packed = 0  # its length with single-space joins; 0 = empty
+    # Lazy over finditer (no list of offsets), plus end-of-text as the last break
+    breaks = itertools.chain(((m.start(), m.end()) for m in _SENT_BREAK.finditer(text)), [(len(text), len(text))])
+    for sent_end, next_start in breaks:
+        n = sent_end - sent_start
+        if packed and packed + 1 + n > limit:
+            chunks.append(_SENT_BREAK.sub(" ", text[chunk_start:chunk_end]))
+            packed = 0
+        if packed:
+            packed += 1 + n
+        else:
+            chunk_start, packed = sent_start, n
+        chunk_end, sent_start = sent_end, next_start
+    if packed:
+        chunks.append(_SENT_BREAK.sub(" ", text[chunk_start:chunk_end]))
+    return chunks
+
+# === Inference worker ==========================================================
+# One consumer thread owns the model: concurrent requests queue up instead of
+# contending for the GPU from many threadpool threads.
+_INFER_QUEUE: "queue.Queue[tuple[str, float | None, int, Future]]" = queue.Queue()
+
+def _infer_loop() -> None:
+    # Jobs run one at a time: Coqui's Tacotron2 decoder only stops correctly
+    # at batch size 1, so there is nothing to gain from draining several
+    while True:
+        text, speed, sr, fut = _INFER_QUEUE.get()
+        if not fut.set_running_or_notify_cancel():
+            continue
+        try:
+            fut.set_result(synthesize(text, speed, sr))
+        except Exception as ex:
+            fut.set_exception(ex)
+
+threading.Thread(target=_infer_loop, name="tts-infer", daemon=True).start()
+
+def submit_synthesis(text: str, speed: float | None = None, sr: int = DEFAULT_SR) -> asyncio.Future:
+    fut: Future = Future()
+    _INFER_QUEUE.put((text, speed, sr, fut))
+    return asyncio.wrap_future(fut)
+
+# Repeat prompts (UI replays, canned replies) skip synthesis. PCM is resampled to
+# the requested rate, so text, effective speed and sample rate make up the key.
+# Touched from the event loop only, so no lock.
+_PCM_CACHE: "OrderedDict[tuple[bytes, float, int], bytes]" = OrderedDict()
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+def _cache_key(text: str, speed: float | None, sr: int = DEFAULT_SR) -> tuple[bytes, float, int]:
+    eff_speed = speed if speed is not None else DEFAULT_SPEED
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), round(float(eff_speed), 3), sr
+
+async def synthesize_chunk_to_pcm(text: str, speed: float | None = None, sr: int = DEFAULT_SR) -> bytes:
+    if AUDIO_CACHE_SIZE <= 0 or len(text) > CACHE_MAX_CHARS:
+        return float32_to_pcm_bytes(await submit_synthesis(text, speed, sr))
+    key = _cache_key(text, speed, sr)
+    pcm = _PCM_CACHE.get(key)
+    if pcm is not None:
+        _PCM_CACHE.move_to_end(key)
+        CACHE_STATS["hits"] += 1
+        return pcm
+    CACHE_STATS["misses"] += 1
+    pcm = float32_to_pcm_bytes(await submit_synthesis(text, speed, sr))
+    _PCM_CACHE[key] = pcm
+    if len(_PCM_CACHE) > AUDIO_CACHE_SIZE:
+        _PCM_CACHE.popitem(last=False)
+    return pcm
+
+def micro_batches(chunks: list[str], size: int = STREAM_BATCH) -> list[list[str]]:
+    """First chunk alone (keeps time-to-first-audio), then groups of up to `size`."""
+    if not chunks:
+        return []
+    rest = chunks[1:]
+    return [chunks[:1]] + [rest[i:i + size] for i in range(0, len(rest), size)]
+
+async def iter_chunk_pcm(chunks: list[str], speed: float | None = None, sr: int = DEFAULT_SR):
+    """Yield each chunk's PCM in order, keeping at most one micro-batch queued ahead.
+
+    The bounded window lets other callers' chunks interleave on the FIFO
+    inference queue instead of waiting behind a whole long utterance.
+    A failed chunk raises; anything still queued is cancelled on exit.
+    """
+    batches = micro_batches(chunks)
+
+    def queue_batch(batch: list[str]) -> list[asyncio.Future]:
+        # Queue the whole batch so the worker runs it back-to-back
+        return [asyncio.ensure_future(synthesize_chunk_to_pcm(part, speed, sr)) for part in batch]
+
+    pending = queue_batch(batches[0]) if batches else []
+    ahead: list[asyncio.Future] = []
+    try:
+        for b in range(len(batches)):
+            for i, fut in enumerate(pending):
+                pcm = await fut
+                if i == len(pending) - 1 and b + 1 < len(batches):
+                    # Worker is free: start the next batch before this chunk is consumed,
+                    # so its synthesis overlaps the send (one batch in flight ahead)
+                    ahead = queue_batch(batches[b + 1])
+                yield pcm
+            pending, ahead = ahead, []
+    finally:
+        # Consumer gone or chunk failed: drop work the worker hasn't started
+        for fut in pending + ahead:
+            fut.cancel()
+
+# === Endpoints =================================================================
+def _request_sr(req: SpeakRequest) -> int:
+    sr = int(req.sample_rate or DEFAULT_SR)
+    if not MIN_SR <= sr <= MAX_SR:
+        raise HTTPException(status_code=400, detail=f"sample_rate must be {MIN_SR}-{MAX_SR}")
+    return sr
+
+@app.post("/speak")
+async def speak(req: SpeakRequest):
+    text = (req.text or "").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Missing text")
+    sr = _request_sr(req)
+    long_text = len(text) > LONG_TEXT_CHARS
+
+    if req.stream:
+        framing = req.framing or DEFAULT_FRAMING
+        if framing not in (STREAM_FRAMING, STREAM_FRAMING_RAW):
+            raise HTTPException(status_code=400, detail=f"Unknown framing: {framing}")
+        raw = framing == STREAM_FRAMING_RAW
+        chunks = chunk_text(text)
+        template = wav_header_template(sr)
+        if len(chunks) > 1:
+            # Phonemize later chunks while the first one is on the GPU
+            asyncio.get_running_loop().run_in_executor(None, pretokenize, chunks[1:])
+
+        async def gen():
+            pcm_iter = iter_chunk_pcm(chunks, req.speed, sr)
+            try:
+                if raw:
+                    yield streaming_wav_header(sr)
+                async for pcm in pcm_iter:
+                    # Raw: cached PCM goes out as is, no per-chunk header or prefix
+                    yield pcm if raw else stream_frame(template, pcm)
+            except Exception as ex:
+                logger.warning("TTS chunk failed, ending stream: %s", ex)
+            finally:
+                await pcm_iter.aclose()  # client gone: cancel queued chunks now
+
+        headers = {"Cache-Control": "no-store", "X-Stream-Framing": framing}
+        media_type = "audio/wav" if raw else "application/octet-stream"
+        return StreamingResponse(gen(), media_type=media_type, headers=headers)
+
+    start = time.perf_counter()
+    try:
+        if long_text:
+            # Same bounded prefetch window as streaming, so concurrent callers interleave
+            pcm = b"".join([part async for part in iter_chunk_pcm(chunk_text(text), req.speed, sr)])
+        else:
+            pcm = await synthesize_chunk_to_pcm(text, req.speed, sr)
+    except Exception as ex:
+        logger.exception("TTS synthesis failed: %s", ex)
+        return JSONResponse(status_code=500, content={"error": f"TTS synthesis failed: {ex}"})
+    header = make_wav_header(len(pcm), sample_rate=sr)
+    # samples/duration live in /speak_debug; keep the hot path to what the response needs
+    logger.info(
+        "speak chars=%s pcm_bytes=%s long_text=%s elapsed_ms=%s",
+        len(text), len(pcm), long_text, int((time.perf_counter() - start) * 1000),
+    )
+    # One body write: a streamed header + PCM pair costs more per request in
+    # Starlette's send loop than the single header+PCM copy does
+    return Response(content=header + pcm, media_type="audio/wav", headers={"Cache-Control": "no-store"})
+
+@app.post("/speak_debug")
+async def speak_debug(req: SpeakRequest):
+    text = (req.text or "").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Missing text")
+    sr = _request_sr(req)
+    start = time.perf_counter()
+    try:
+        pcm = await synthesize_chunk_to_pcm(text, req.speed, sr)
+    except Exception as ex:
+        logger.exception("TTS synthesis failed: %s", ex)
+        return JSONResponse(status_code=500, content={"error": f"TTS synthesis failed: {ex}"})
+    synth_ms = int((time.perf_counter() - start) * 1000)
+    pcm_len = len(pcm)
+    samples = pcm_len // 2  # int16 mono
+    return {
+        "model": MODEL_ID,
+        "device": tts.device,
+        "sample_rate": sr,
+        "speed": req.speed if req.speed is not None else DEFAULT_SPEED,
+        "samples": samples,
+        "pcm_bytes": pcm_len,
+        "wav_bytes": len(_HDR_TEMPLATE) + pcm_len,
+        "duration_sec": round(samples / sr, 3),
+        "synth_ms": synth_ms,
+    }
+
+def _json_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# Probe answers are fixed once startup is done (device never moves at runtime),
+# so encode them once; /health only splices in the live cache counters
+_HEALTH_HEAD = _json_bytes({
+    "status": "ok",
+    "model": MODEL_ID,
+    "device": tts.device,
+    "sample_rate": DEFAULT_SR,
+    "warmed_up": WARMED_UP,
+})[:-1]
+_ENV_DEBUG_JSON = _json_bytes({
+    "torch": torch_version,
+    "cuda_available": cuda_avail,
+    "cuda_count": cuda_count,
+    "current_device": current_device,
+    "device_name": device_name,
+    "device_used": device_used,
+    "tts_device_env": TTS_DEVICE,
+    "init_ms": init_ms,
+    "default_speed": DEFAULT_SPEED,
+    "default_sr": DEFAULT_SR,
+})
+
+@app.get("/health")
+def health():
+    body = _HEALTH_HEAD + b',"cache_hits":%d,"cache_misses":%d,"cache_entries":%d}' % (
+        CACHE_STATS["hits"], CACHE_STATS["misses"], len(_PCM_CACHE),
+    )
+    return Response(content=body, media_type="application/json")
+
+@app.get("/env_debug")
+def env_debug():
+    return Response(content=_ENV_DEBUG_JSON, media_type="application/json")
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5002")))